@@ -17,7 +17,9 @@ Run:
 import json
 import struct
 import sys
+import time
 import io
+import os
 import subprocess
 from unittest.mock import patch, MagicMock, mock_open
 import pytest
@@ -29,14 +31,17 @@ import ytdlp_host
 class TestNativeMessagingProtocol:
     """Test native messaging protocol implementation"""
 
-    def test_send_message_valid_dict(self, capsys):
+    def test_send_message_valid_dict(self, capsysbinary):
         """Test sending a valid dictionary message"""
         msg = {"ok": True, "test": "value"}
         ytdlp_host.send_message(msg)
         
-        captured = capsys.readouterr()
-        # Check that something was written (can't easily capture binary stdout)
-        assert captured.err == ""  # No errors to stderr
+        captured = capsysbinary.readouterr()
+        # Output is a single frame: 4-byte length prefix followed by the JSON body
+        (length,) = struct.unpack('<I', captured.out[:4])
+        assert length == len(captured.out) - 4
+        assert json.loads(captured.out[4:]) == msg
+        assert captured.err == b""  # No errors to stderr
 
     def test_send_message_with_unicode(self, capsys):
         """Test sending message with unicode characters"""
@@ -100,6 +105,21 @@ class TestNativeMessagingProtocol:
         assert result is None
 
 
+    def test_main_serves_until_eof(self):
+        """Test main handles every queued message before exiting"""
+        frames = b''
+        for i in range(2):
+            encoded = json.dumps({"url": f"u{i}"}).encode('utf-8')
+            frames += struct.pack('<I', len(encoded)) + encoded
+
+        with patch('sys.stdin', MagicMock(buffer=io.BytesIO(frames))), \
+                patch('ytdlp_host.handle_request', side_effect=lambda req: {"ok": True, "url": req["url"]}), \
+                patch('ytdlp_host.send_message') as mock_send:
+            ytdlp_host.main()
+
+        assert [c.args[0]["url"] for c in mock_send.call_args_list] == ["u0", "u1"]
+
+
 class TestUtilityFunctions:
     """Test utility helper functions"""
 
@@ -152,21 +172,54 @@ class TestUtilityFunctions:
         """Test invalid input returns None"""
         assert ytdlp_host.humanize_duration("invalid") is None
 
+    def test_humanize_duration_negative(self):
+        """Test negative input returns None"""
+        assert ytdlp_host.humanize_duration(-5) is None
+
+
+@pytest.fixture(scope="session")
+def dump_json_stdout():
+    """Raw yt-dlp -J stdout for a successful metadata fetch"""
+    return ytdlp_host._json_dumps({
+        "duration": 180,
+        "title": "Test Video",
+        "formats": []
+    })
+
+
+class TestUrlValidation:
+    """Test YouTube URL validation and injection blocking"""
+
+    def test_valid_urls(self):
+        """Test supported YouTube URL shapes are accepted"""
+        assert ytdlp_host.is_valid_youtube_url("https://www.youtube.com/watch?v=dQw4w9WgXcQ")
+        assert ytdlp_host.is_valid_youtube_url("https://m.youtube.com/watch?v=dQw4w9WgXcQ")
+        assert ytdlp_host.is_valid_youtube_url("https://youtube.com/shorts/dQw4w9WgXcQ")
+        assert ytdlp_host.is_valid_youtube_url("HTTPS://YOUTU.BE/dQw4w9WgXcQ")
+
+    def test_rejects_non_youtube(self):
+        """Test other hosts and schemes are rejected"""
+        assert not ytdlp_host.is_valid_youtube_url("http://www.youtube.com/watch?v=dQw4w9WgXcQ")
+        assert not ytdlp_host.is_valid_youtube_url("https://evil.com/watch?v=dQw4w9WgXcQ")
+        assert not ytdlp_host.is_valid_youtube_url("")
+        assert not ytdlp_host.is_valid_youtube_url(None)
+
+    def test_rejects_dangerous_characters(self):
+        """Test shell metacharacters and traversal are rejected"""
+        for suffix in ("; rm -rf /", "$(id)", "`id`", "&x=1|y", "/../etc", "<x>"):
+            assert not ytdlp_host.is_valid_youtube_url("https://www.youtube.com/watch?v=dQw4w9WgXcQ" + suffix)
+
 
 class TestYtDlpIntegration:
     """Test yt-dlp command execution and parsing"""
 
     @patch('subprocess.run')
-    def test_run_ytdlp_dump_json_success(self, mock_run):
+    def test_run_ytdlp_dump_json_success(self, mock_run, dump_json_stdout):
         """Test successful yt-dlp metadata extraction"""
         mock_result = MagicMock()
         mock_result.returncode = 0
-        mock_result.stdout = json.dumps({
-            "duration": 180,
-            "title": "Test Video",
-            "formats": []
-        })
-        mock_result.stderr = ""
+        mock_result.stdout = dump_json_stdout
+        mock_result.stderr = b""
         mock_run.return_value = mock_result
 
         meta, err, code = ytdlp_host.run_ytdlp_dump_json("https://youtube.com/watch?v=dQw4w9WgXcQ")
@@ -176,6 +229,40 @@ class TestYtDlpIntegration:
         assert meta["duration"] == 180
         assert meta["title"] == "Test Video"
 
+    @patch('ytdlp_host.find_yt_dlp', return_value='yt-dlp')
+    @patch('subprocess.run')
+    def test_spawn_ytdlp_handles(self, mock_run, _mock_find):
+        """Test yt-dlp gets a null stdin and only inherits handles on POSIX"""
+        ytdlp_host._spawn_ytdlp(["--version"], 5)
+
+        kwargs = mock_run.call_args.kwargs
+        assert kwargs["stdin"] == subprocess.DEVNULL
+        assert kwargs["close_fds"] is (os.name == 'nt')
+
+    @patch('subprocess.run')
+    def test_run_ytdlp_dump_json_slims_metadata(self, mock_run):
+        """Test unused metadata is dropped unless full output is requested"""
+        mock_result = MagicMock()
+        mock_result.returncode = 0
+        mock_result.stdout = ytdlp_host._json_dumps({
+            "duration": 180,
+            "thumbnails": [{"url": "https://i.ytimg.com/vi/x/0.jpg"}],
+            "formats": [{"format_id": "251", "filesize": 1000, "url": "https://example.com"}]
+        })
+        mock_result.stderr = b""
+        mock_run.return_value = mock_result
+
+        meta, err, code = ytdlp_host.run_ytdlp_dump_json("https://youtube.com/watch?v=dQw4w9WgXcQ")
+
+        assert code == 0
+        assert "thumbnails" not in meta
+        assert meta["formats"] == [{"format_id": "251", "filesize": 1000}]
+
+        meta, err, code = ytdlp_host.run_ytdlp_dump_json("https://youtube.com/watch?v=dQw4w9WgXcQ", full=True)
+
+        assert "thumbnails" in meta
+        assert meta["formats"][0]["url"] == "https://example.com"
+
     @patch('subprocess.run')
     def test_run_ytdlp_dump_json_not_found(self, mock_run):
         """Test yt-dlp not found error"""
@@ -203,8 +290,8 @@ class TestYtDlpIntegration:
         """Test yt-dlp non-zero exit code"""
         mock_result = MagicMock()
         mock_result.returncode = 1
-        mock_result.stdout = ""
-        mock_result.stderr = "ERROR: Video unavailable"
+        mock_result.stdout = b""
+        mock_result.stderr = b"ERROR: Video unavailable"
         mock_run.return_value = mock_result
 
         meta, err, code = ytdlp_host.run_ytdlp_dump_json("https://youtube.com/watch?v=dQw4w9WgXcQ")
@@ -218,8 +305,8 @@ class TestYtDlpIntegration:
         """Test handling of invalid JSON response"""
         mock_result = MagicMock()
         mock_result.returncode = 0
-        mock_result.stdout = "{invalid json}"
-        mock_result.stderr = ""
+        mock_result.stdout = b"{invalid json}"
+        mock_result.stderr = b""
         mock_run.return_value = mock_result
 
         meta, err, code = ytdlp_host.run_ytdlp_dump_json("https://youtube.com/watch?v=dQw4w9WgXcQ")
@@ -277,48 +364,39 @@ class TestSizeCalculation:
         assert result == 1000000
 
 
-class TestFormatParsing:
-    """Test parsing size information from yt-dlp format list"""
+    def test_get_num(self):
+        """Test numbers pass through and other values are converted or rejected"""
+        assert ytdlp_host._get_num(1500) == 1500
+        assert ytdlp_host._get_num(12.5) == 12.5
+        assert ytdlp_host._get_num(True) == 1.0 and type(ytdlp_host._get_num(True)) is float
+        assert ytdlp_host._get_num("7.5") == 7.5
+        assert ytdlp_host._get_num("n/a") is None
+        assert ytdlp_host._get_num(None) is None
 
-    def test_parse_sizes_from_format_list_valid(self):
-        """Test parsing valid format list output"""
-        format_text = """
-        ID  EXT   RESOLUTION FPS │   FILESIZE   TBR PROTO │ VCODEC        VBR ACODEC
-        394 mp4   256x144     24 │    5.50MiB   123k https │ av01.0.00M.08 123k video only
-        398 mp4   1280x720    30 │   45.23MiB  2000k https │ av01.0.05M.08 2000k video only
-        251 webm  audio only     │   12.34MiB   256k https │ audio only        opus
-        """
-        
-        sizes = ytdlp_host.parse_sizes_from_format_list(format_text)
-        
-        assert sizes["394"] is not None
-        assert sizes["398"] is not None
-        assert sizes["251"] is not None
-        assert sizes["394"] < sizes["398"]  # 144p < 720p
-
-    def test_parse_sizes_from_format_list_empty(self):
-        """Test parsing empty format list"""
-        sizes = ytdlp_host.parse_sizes_from_format_list("")
-        
-        # All sizes should be None
-        assert all(v is None for v in sizes.values())
-
-    def test_parse_sizes_from_format_list_missing_size(self):
-        """Test handling formats without size information"""
-        format_text = """
-        ID  EXT   RESOLUTION FPS │   FILESIZE   TBR PROTO │ VCODEC
-        398 mp4   1280x720    30 │      ~  n/a https │ av01.0.05M.08
-        """
-        
-        sizes = ytdlp_host.parse_sizes_from_format_list(format_text)
-        
-        # Size should still be None since format doesn't have size data
-        assert sizes["398"] is None
+    def test_compute_sizes_estimates_hls_only_formats(self):
+        """Test sizes are estimated from bitrates when only HLS formats exist"""
+        meta = {"duration": 100, "formats": [
+            {"format_id": "93", "ext": "mp4", "protocol": "m3u8_native",
+             "vcodec": "avc1.4d401e", "acodec": "mp4a.40.2", "height": 360, "tbr": 800},
+            {"format_id": "95", "ext": "mp4", "protocol": "m3u8_native",
+             "vcodec": "avc1.4d401f", "acodec": "mp4a.40.2", "height": 720, "tbr": 2000},
+        ]}
+
+        sizes, _video_only, _a251, _dur = ytdlp_host.compute_sizes_from_json_all(meta)
+
+        assert sizes["s360p"] == 800 * 125 * 100
+        assert sizes["s720p"] == 2000 * 125 * 100
 
 
 class TestFindYtDlp:
     """Test yt-dlp executable detection"""
 
+    def setup_method(self):
+        ytdlp_host.find_yt_dlp.cache_clear()
+
+    def teardown_method(self):
+        ytdlp_host.find_yt_dlp.cache_clear()
+
     def test_find_yt_dlp_returns_string(self):
         """Test that find_yt_dlp returns a string path"""
         result = ytdlp_host.find_yt_dlp()
@@ -344,15 +422,313 @@ class TestFindYtDlp:
                 result = ytdlp_host.find_yt_dlp()
                 assert 'yt-dlp' in result.lower()
 
+    @patch('ytdlp_host.shutil.which', return_value='/usr/local/bin/yt-dlp')
+    @patch('pathlib.Path.exists')
+    def test_find_yt_dlp_fallback_to_path(self, mock_exists, mock_which):
+        """Test fallback to the PATH-resolved executable when none is bundled"""
+        mock_exists.return_value = False
+        
+        result = ytdlp_host.find_yt_dlp()
+        assert result == '/usr/local/bin/yt-dlp'
+        mock_which.assert_called_once_with('yt-dlp')
+
+    @patch('ytdlp_host.shutil.which', return_value=None)
     @patch('pathlib.Path.exists')
-    def test_find_yt_dlp_fallback_to_path(self, mock_exists):
-        """Test fallback to PATH when no bundled executable"""
+    def test_find_yt_dlp_not_on_path(self, mock_exists, _mock_which):
+        """Test the bare command name is returned when PATH has no yt-dlp"""
         mock_exists.return_value = False
         
         result = ytdlp_host.find_yt_dlp()
         assert result == 'yt-dlp'
 
 
+class TestHandleRequest:
+    """Test request handling and yt-dlp fallbacks"""
+
+    URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+    @patch('ytdlp_host._fetch_duration_innertube', return_value=None)
+    @patch('ytdlp_host._fetch_player_innertube', return_value=(None, None))
+    @patch('ytdlp_host._cache_get', return_value=None)
+    @patch('ytdlp_host.run_ytdlp_dump_json')
+    def test_timeout_reports_error(self, mock_dump, _mock_cache, _mock_player, _mock_dur):
+        """Test a -J timeout is reported as such"""
+        mock_dump.return_value = (None, "yt-dlp timed out while fetching metadata.", 124)
+
+        resp = ytdlp_host.handle_request({"url": self.URL})
+
+        assert resp["ok"] is False
+        assert "timed out" in resp["error"]
+
+    @patch('urllib.request.urlopen')
+    def test_fetch_duration_innertube(self, mock_urlopen):
+        """Test duration is read from InnerTube videoDetails"""
+        mock_urlopen.return_value.__enter__.return_value.read.return_value = \
+            b'{"videoDetails": {"lengthSeconds": "212"}}'
+
+        assert ytdlp_host._fetch_duration_innertube("dQw4w9WgXcQ") == 212
+
+    @patch('urllib.request.urlopen', side_effect=OSError("network down"))
+    def test_fetch_duration_innertube_failure(self, _mock_urlopen):
+        """Test network errors yield None instead of raising"""
+        assert ytdlp_host._fetch_duration_innertube("dQw4w9WgXcQ") is None
+
+    @patch('urllib.request.urlopen')
+    def test_innertube_player_request(self, mock_urlopen):
+        """Test the player request carries the ANDROID client body and headers"""
+        mock_urlopen.return_value.__enter__.return_value.read.return_value = b'{}'
+
+        ytdlp_host._innertube_player("dQw4w9WgXcQ", 5)
+
+        req = mock_urlopen.call_args.args[0]
+        version = ytdlp_host.INNERTUBE_CLIENT_VERSION
+        user_agent = f"com.google.android.youtube/{version} (Linux; U; Android 11) gzip"
+        assert req.full_url == "https://www.youtube.com/youtubei/v1/player?prettyPrint=false"
+        assert json.loads(req.data) == {
+            "context": {"client": {"clientName": "ANDROID", "clientVersion": version,
+                                   "androidSdkVersion": 30, "osName": "Android", "osVersion": "11",
+                                   "userAgent": user_agent, "hl": "en"}},
+            "videoId": "dQw4w9WgXcQ",
+        }
+        assert req.get_header("User-agent") == user_agent
+        assert req.get_header("Content-type") == "application/json"
+        assert req.get_header("X-youtube-client-name") == "3"
+        assert req.get_header("X-youtube-client-version") == version
+        assert mock_urlopen.call_args.kwargs["timeout"] == 5
+
+    @patch('urllib.request.urlopen')
+    def test_fetch_player_innertube(self, mock_urlopen):
+        """Test InnerTube streamingData is mapped to yt-dlp style formats"""
+        mock_urlopen.return_value.__enter__.return_value.read.return_value = json.dumps({
+            "playabilityStatus": {"status": "OK"},
+            "videoDetails": {"lengthSeconds": "212"},
+            "streamingData": {
+                "formats": [{"itag": 18, "mimeType": 'video/mp4; codecs="avc1.42001E, mp4a.40.2"',
+                             "bitrate": 500000, "height": 360}],
+                "adaptiveFormats": [
+                    {"itag": 398, "mimeType": 'video/mp4; codecs="av01.0.05M.08"',
+                     "bitrate": 2000000, "height": 720, "fps": 30, "contentLength": "20000000"},
+                    {"itag": 251, "mimeType": 'audio/webm; codecs="opus"',
+                     "bitrate": 130000, "contentLength": "3400000"},
+                ],
+            },
+        }).encode('utf-8')
+
+        meta, duration = ytdlp_host._fetch_player_innertube("dQw4w9WgXcQ")
+
+        assert meta["duration"] == duration == 212
+        by_id = {f["format_id"]: f for f in meta["formats"]}
+        assert by_id["18"]["acodec"] == "mp4a.40.2" and "filesize" not in by_id["18"]
+        assert by_id["398"] == {"format_id": "398", "tbr": 2000.0, "vcodec": "av01.0.05M.08", "ext": "mp4",
+                                "acodec": "none", "height": 720, "fps": 30, "filesize": 20000000}
+        assert by_id["251"]["vcodec"] == "none" and by_id["251"]["filesize"] == 3400000
+
+    @patch('urllib.request.urlopen')
+    def test_fetch_player_innertube_unplayable(self, mock_urlopen):
+        """Test unplayable responses fall back to yt-dlp but keep the duration"""
+        mock_urlopen.return_value.__enter__.return_value.read.return_value = \
+            b'{"playabilityStatus": {"status": "LOGIN_REQUIRED"}, "videoDetails": {"lengthSeconds": "212"}}'
+
+        assert ytdlp_host._fetch_player_innertube("dQw4w9WgXcQ") == (None, 212)
+
+    @patch('ytdlp_host._fetch_duration_innertube', return_value=None)
+    @patch('ytdlp_host._fetch_player_innertube', return_value=(None, None))
+    @patch('ytdlp_host._cache_get', return_value=None)
+    @patch('ytdlp_host.run_ytdlp_dump_json')
+    def test_dump_json_failure_reports_stderr(self, mock_dump, _mock_cache, _mock_player, _mock_dur):
+        """Test yt-dlp's error output is surfaced when -J fails"""
+        mock_dump.return_value = (None, "ERROR: Video unavailable", 1)
+
+        resp = ytdlp_host.handle_request({"url": self.URL})
+
+        assert resp == {"ok": False, "error": "ERROR: Video unavailable"}
+
+    @patch('ytdlp_host._fetch_duration_innertube')
+    @patch('ytdlp_host._fetch_player_innertube', return_value=(None, 212))
+    @patch('ytdlp_host._cache_put')
+    @patch('ytdlp_host._cache_get', return_value=None)
+    @patch('ytdlp_host.run_ytdlp_dump_json')
+    def test_missing_duration_reuses_player_response(self, mock_dump, _mock_cache, _mock_put, _mock_player, mock_dur):
+        """Test a duration missing from -J comes from the player request already made"""
+        mock_dump.return_value = ({"formats": [
+            {"format_id": "398", "vcodec": "av01", "acodec": "none", "height": 720, "filesize": 45000000},
+            {"format_id": "251", "vcodec": "none", "acodec": "opus", "filesize": 12000000},
+        ]}, None, 0)
+
+        resp = ytdlp_host.handle_request({"url": self.URL})
+
+        assert resp["bytes"]["s720p"] == 57000000
+        assert resp["duration"] == 212
+        mock_dur.assert_not_called()
+
+    @patch('ytdlp_host._fetch_duration_innertube', return_value=212)
+    @patch('ytdlp_host._fetch_player_innertube')
+    @patch('ytdlp_host._cache_get', return_value={"formats": [
+        {"format_id": "398", "vcodec": "av01", "acodec": "none", "height": 720, "filesize": 45000000},
+        {"format_id": "251", "vcodec": "none", "acodec": "opus", "filesize": 12000000}]})
+    def test_cached_metadata_without_duration_fetches_it_once(self, _mock_cache, mock_player, mock_dur):
+        """Test a cache hit lacking duration costs one duration lookup"""
+        resp = ytdlp_host.handle_request({"url": self.URL})
+
+        assert resp["duration"] == 212
+        mock_player.assert_not_called()
+        mock_dur.assert_called_once_with("dQw4w9WgXcQ")
+
+    @patch('ytdlp_host._fetch_duration_innertube', return_value=212)
+    @patch('ytdlp_host._cache_get', return_value={"formats": []})
+    def test_no_sizes_skips_duration_lookup(self, _mock_cache, mock_dur):
+        """Test the duration lookup is skipped when the response is an error anyway"""
+        resp = ytdlp_host.handle_request({"url": self.URL})
+
+        assert resp["ok"] is False
+        mock_dur.assert_not_called()
+
+    @patch('ytdlp_host._cache_put')
+    @patch('ytdlp_host._fetch_player_innertube', return_value=({"duration": 212, "formats": [
+        {"format_id": "251", "vcodec": "none", "acodec": "opus", "filesize": 3400000}]}, 212))
+    @patch('ytdlp_host._cache_get', return_value=None)
+    @patch('ytdlp_host.run_ytdlp_dump_json')
+    def test_innertube_without_sizes_falls_back_to_ytdlp(self, mock_dump, _mock_cache, _mock_player, mock_put):
+        """Test InnerTube metadata that yields no sizes is neither used nor cached"""
+        ytdlp_meta = {"duration": 212, "formats": [
+            {"format_id": "398", "vcodec": "av01", "acodec": "none", "height": 720, "filesize": 45000000},
+            {"format_id": "251", "vcodec": "none", "acodec": "opus", "filesize": 12000000},
+        ]}
+        mock_dump.return_value = (ytdlp_meta, None, 0)
+
+        resp = ytdlp_host.handle_request({"url": self.URL})
+
+        assert resp["bytes"]["s720p"] == 57000000
+        mock_dump.assert_called_once()
+        mock_put.assert_called_once_with("dQw4w9WgXcQ", ytdlp_meta)
+
+    @patch('ytdlp_host._cache_put')
+    @patch('ytdlp_host._fetch_player_innertube', return_value=(None, None))
+    @patch('ytdlp_host._cache_get', return_value=None)
+    @patch('ytdlp_host.run_ytdlp_dump_json', return_value=({"duration": 212, "formats": []}, None, 0))
+    def test_metadata_without_sizes_not_cached(self, _mock_dump, _mock_cache, _mock_player, mock_put):
+        """Test a lookup that yields no sizes does not pin its metadata in the cache"""
+        resp = ytdlp_host.handle_request({"url": self.URL, "duration_hint": 212})
+
+        assert resp["ok"] is False
+        mock_put.assert_not_called()
+
+    @patch('ytdlp_host.time')
+    @patch('ytdlp_host._fetch_player_innertube', return_value=(None, None))
+    @patch('ytdlp_host._cache_get', return_value=None)
+    @patch('ytdlp_host.run_ytdlp_dump_json', return_value=(None, "yt-dlp timed out while fetching metadata.", 124))
+    def test_ytdlp_timeout_shares_request_budget(self, mock_dump, _mock_cache, _mock_player, mock_time):
+        """Test time spent on InnerTube is taken out of yt-dlp's timeout"""
+        mock_time.monotonic.side_effect = [100.0, 107.0]
+
+        ytdlp_host.handle_request({"url": self.URL, "duration_hint": 212})
+
+        assert mock_dump.call_args.kwargs["timeout_sec"] == ytdlp_host.REQUEST_BUDGET_SEC - 7
+
+
+class TestMetadataCache:
+    """Test the on-disk yt-dlp metadata cache"""
+
+    def test_extract_video_id(self):
+        """Test video ID extraction from supported URL shapes"""
+        assert ytdlp_host.extract_video_id("https://www.youtube.com/watch?v=dQw4w9WgXcQ") == "dQw4w9WgXcQ"
+        assert ytdlp_host.extract_video_id("https://youtu.be/dQw4w9WgXcQ") == "dQw4w9WgXcQ"
+        assert ytdlp_host.extract_video_id("https://example.com/watch?v=dQw4w9WgXcQ") is None
+
+    def test_cache_roundtrip(self, tmp_path):
+        """Test stored metadata is returned on the next lookup"""
+        meta = {"duration": 180, "formats": [{"format_id": "251", "filesize": 1000}]}
+        with patch('ytdlp_host._cache_dir', return_value=tmp_path):
+            assert ytdlp_host._cache_get("dQw4w9WgXcQ") is None
+            ytdlp_host._cache_put("dQw4w9WgXcQ", meta)
+            assert ytdlp_host._cache_get("dQw4w9WgXcQ") == meta
+
+    def test_cache_expired(self, tmp_path):
+        """Test entries past their expiry are ignored"""
+        with patch('ytdlp_host._cache_dir', return_value=tmp_path):
+            ytdlp_host._cache_put("dQw4w9WgXcQ", {"duration": 180})
+            with patch('ytdlp_host.time') as mock_time:
+                mock_time.time.return_value = time.time() + ytdlp_host.META_CACHE_TTL_SEC + 1
+                assert ytdlp_host._cache_get("dQw4w9WgXcQ") is None
+
+    def test_cache_skips_live_streams(self, tmp_path):
+        """Test live and upcoming streams are not cached"""
+        with patch('ytdlp_host._cache_dir', return_value=tmp_path):
+            ytdlp_host._cache_put("aaaaaaaaaaa", {"live_status": "is_live"})
+            ytdlp_host._cache_put("bbbbbbbbbbb", {"is_live": True})
+            ytdlp_host._cache_put("ccccccccccc", {"live_status": "is_upcoming"})
+            assert list(tmp_path.glob('*.json')) == []
+
+    def test_cache_ttl_short_for_recent_uploads(self):
+        """Test fresh uploads expire sooner than older videos"""
+        assert ytdlp_host._cache_ttl({"timestamp": time.time() - 3600}) == ytdlp_host.META_CACHE_RECENT_TTL_SEC
+        assert ytdlp_host._cache_ttl({"timestamp": time.time() - 30 * 86400}) == ytdlp_host.META_CACHE_TTL_SEC
+        # No known upload time: treated like a fresh upload
+        assert ytdlp_host._cache_ttl({}) == ytdlp_host.META_CACHE_RECENT_TTL_SEC
+
+    @staticmethod
+    def _player_response(**extra):
+        data = {
+            "playabilityStatus": {"status": "OK"},
+            "videoDetails": {"lengthSeconds": "212"},
+            "streamingData": {"adaptiveFormats": [
+                {"itag": 398, "mimeType": 'video/mp4; codecs="av01.0.05M.08"',
+                 "bitrate": 2000000, "height": 720, "contentLength": "20000000"},
+                {"itag": 251, "mimeType": 'audio/webm; codecs="opus"',
+                 "bitrate": 130000, "contentLength": "3400000"},
+            ]},
+        }
+        data.update(extra)
+        return json.dumps(data).encode('utf-8')
+
+    def _stored_ttl(self, tmp_path, player_response):
+        with patch('ytdlp_host._cache_dir', return_value=tmp_path), \
+                patch('urllib.request.urlopen') as mock_urlopen, \
+                patch('ytdlp_host.run_ytdlp_dump_json') as mock_dump:
+            mock_urlopen.return_value.__enter__.return_value.read.return_value = player_response
+            resp = ytdlp_host.handle_request({"url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ"})
+            mock_dump.assert_not_called()
+        assert resp["ok"] is True
+        entry = json.loads((tmp_path / "dQw4w9WgXcQ.json").read_bytes())
+        return entry["expires"] - time.time()
+
+    def test_innertube_result_without_date_cached_briefly(self, tmp_path):
+        """Test InnerTube metadata without a publish date gets the short TTL"""
+        ttl = self._stored_ttl(tmp_path, self._player_response())
+
+        assert ttl == pytest.approx(ytdlp_host.META_CACHE_RECENT_TTL_SEC, abs=60)
+
+    def test_innertube_result_old_upload_cached_fully(self, tmp_path):
+        """Test an InnerTube publish date older than the recent window gets the full TTL"""
+        ttl = self._stored_ttl(tmp_path, self._player_response(
+            microformat={"playerMicroformatRenderer": {"publishDate": "2009-10-25T00:00:00-07:00"}}))
+
+        assert ttl == pytest.approx(ytdlp_host.META_CACHE_TTL_SEC, abs=60)
+
+    def test_innertube_publish_timestamp(self):
+        """Test publish dates with and without a time are parsed as UTC-aware timestamps"""
+        def micro(value):
+            return {"microformat": {"playerMicroformatRenderer": {"publishDate": value}}}
+        assert ytdlp_host._innertube_publish_timestamp(micro("2024-05-01")) == 1714521600
+        assert ytdlp_host._innertube_publish_timestamp(micro("2024-05-01T00:00:00-07:00")) == 1714546800
+        assert ytdlp_host._innertube_publish_timestamp(micro("not a date")) is None
+        assert ytdlp_host._innertube_publish_timestamp({}) is None
+
+    def test_cache_evicts_least_recently_used(self, tmp_path):
+        """Test the cache is capped at META_CACHE_MAX_ENTRIES, keeping entries read recently"""
+        with patch('ytdlp_host._cache_dir', return_value=tmp_path), \
+                patch('ytdlp_host.META_CACHE_MAX_ENTRIES', 2):
+            ytdlp_host._cache_put("aaaaaaaaaaa", {"id": "aaaaaaaaaaa"})
+            ytdlp_host._cache_put("bbbbbbbbbbb", {"id": "bbbbbbbbbbb"})
+            old = time.time() - 100
+            os.utime(tmp_path / "aaaaaaaaaaa.json", (old, old))
+            os.utime(tmp_path / "bbbbbbbbbbb.json", (old + 10, old + 10))
+            # Reading "a" makes "b" the least recently used entry
+            assert ytdlp_host._cache_get("aaaaaaaaaaa") == {"id": "aaaaaaaaaaa"}
+            ytdlp_host._cache_put("ccccccccccc", {"id": "ccccccccccc"})
+            assert sorted(p.stem for p in tmp_path.glob('*.json')) == ["aaaaaaaaaaa", "ccccccccccc"]
+
+
 class TestDebugLogging:
     """Test debug logging function"""
 
@@ -10,9 +10,8 @@ Key Features:
 - Native messaging protocol implementation (stdin/stdout)
 - yt-dlp integration for video metadata extraction
 - Multiple data extraction strategies:
-  1. JSON dump (-J) - comprehensive metadata including duration
-  2. Format list (-F) - fallback for size extraction
-  3. Duration fetch (--print) - separate duration query if needed
+  1. InnerTube player API - format sizes from a single HTTPS request
+  2. JSON dump (-J) - comprehensive metadata including duration
 - Support for duration hints to avoid redundant yt-dlp calls
 - Handles multiple resolutions (144p to 1440p)
 - Supports codec variants (H.264, VP9, AV1)
@@ -20,6 +19,8 @@ Key Features:
 Protocol:
 - Input: JSON message with 'url' and optional 'duration_hint'
 - Output: JSON response with size data for multiple resolutions
+- Messages are handled in a loop until the browser closes stdin, so one
+  host process can serve every request sent over a connectNative() port
 
 Usage:
     This script is invoked automatically by the browser extension.
@@ -31,47 +32,100 @@ Version: 0.2.0
 
 import sys
 import struct
+import bisect
 import json
 import subprocess
 import re
 import os
+import time
+import shutil
+import urllib.request
+from datetime import datetime, timezone
+from functools import cache
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, Callable, Union
 
+# orjson is an optional speedup for the message loop; the host must keep
+# working with only the standard library installed. The codec functions are
+# bound once here so the hot paths do not re-check which backend is in use.
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
 
-def is_valid_youtube_url(url: str) -> bool:
-    """Validate that a URL is a legitimate YouTube URL.
+if orjson is not None:
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+else:  # pragma: no cover - depends on the environment
+    # json.loads accepts UTF-8 bytes/bytearray directly
+    _json_loads = json.loads
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+
+# Errors raised for malformed input by either backend (JSONDecodeError and
+# UnicodeDecodeError are ValueErrors; stdlib json can also hit the recursion limit)
+_JSON_DECODE_ERRORS = (ValueError, RecursionError)
+
+
+# Matches https://(www.|m.)?youtube.com/watch?v=... or https://youtu.be/... or https://youtube.com/shorts/...
+# Regex adapted from utils.js/ytdlp.js logic; group 1 is the video ID
+YOUTUBE_URL_RE = re.compile(r'^https://(?:www\.|m\.)?(?:youtube\.com/(?:watch\?v=|shorts/)|youtu\.be/)([\w-]{11})', re.IGNORECASE)
+YOUTUBE_URL_PREFIXES = ('https://www.youtube.com/', 'https://m.youtube.com/',
+                        'https://youtube.com/', 'https://youtu.be/')
+
+# Shell metacharacters (covers command substitution and backticks), path traversal, file protocol
+DANGEROUS_URL_RE = re.compile(r'[;&|`$(){}[\]<>\\]|\.\./|file://')
+
+
+def _match_youtube_url(url: str):
+    """Validate a YouTube URL and return the regex match.
     
-    Prevents command injection by ensuring only valid YouTube URLs are processed.
-    Matches logic in utils.js and ytdlp.js.
+    Args:
+        url: Candidate URL
+        
+    Returns:
+        re.Match: Match whose group 1 is the video ID, or None if invalid/unsafe
     """
     try:
         if not url:
-            return False
+            return None
         if len(url) > 200:
-            return False
+            return None
+        # Cheap prefix check rejects most non-YouTube input before any regex runs
+        if not url[:24].lower().startswith(YOUTUBE_URL_PREFIXES):
+            return None
         
         # Block shell metacharacters and command injection patterns
-        dangerous_patterns = [
-            r'[;&|`$(){}[\]<>\\]', # Shell metacharacters
-            r'\$\(',               # Command substitution
-            r'`',                  # Backtick execution
-            r'\.\./',              # Path traversal
-            r'file://',            # File protocol
-        ]
-        
-        for pattern in dangerous_patterns:
-            if re.search(pattern, url):
-                return False
+        if DANGEROUS_URL_RE.search(url):
+            return None
 
         # Validate it's actually a YouTube URL
-        # Regex adapted from utils.js/ytdlp.js logic
-        # Matches https://(www.|m.)?youtube.com/watch?v=... or https://youtu.be/... or https://youtube.com/shorts/...
-        youtube_regex = re.compile(r'^https://(?:www\.|m\.)?(?:youtube\.com/(?:watch\?v=|shorts/)|youtu\.be/)([\w-]{11})', re.IGNORECASE)
-        match = youtube_regex.match(url)
-        return bool(match)
+        return YOUTUBE_URL_RE.match(url)
     except Exception:
-        return False
+        return None
+
+
+def is_valid_youtube_url(url: str) -> bool:
+    """Validate that a URL is a legitimate YouTube URL.
+    
+    Prevents command injection by ensuring only valid YouTube URLs are processed.
+    Matches logic in utils.js and ytdlp.js.
+    """
+    return _match_youtube_url(url) is not None
+
+
+def extract_video_id(url: str) -> Optional[str]:
+    """Extract the 11-character video ID from a validated YouTube URL.
+    
+    Args:
+        url: YouTube video URL
+        
+    Returns:
+        str: The video ID, or None if the URL is not a valid YouTube URL
+    """
+    match = _match_youtube_url(url)
+    return match.group(1) if match else None
 
 
 def _dbg(msg: str):
@@ -91,6 +145,32 @@ def _dbg(msg: str):
 
 # Native messaging protocol helpers
 
+# Message length prefix: uint32, little-endian
+_U32 = struct.Struct('<I')
+
+def _read_into(stream, buf) -> int:
+    """Fill a preallocated buffer from a binary stream.
+
+    Reads directly into the buffer so large messages are not assembled
+    from intermediate bytes objects.
+
+    Args:
+        stream: Binary stream supporting readinto()
+        buf: Writable buffer (e.g. bytearray) to fill
+
+    Returns:
+        int: Number of bytes read; less than len(buf) on EOF
+    """
+    mv = memoryview(buf)
+    off = 0
+    while off < len(mv):
+        n = stream.readinto(mv[off:])
+        if not n:
+            break
+        off += n
+    return off
+
+
 def read_message():
     """Read a message from stdin using Chrome's native messaging protocol.
     
@@ -101,20 +181,19 @@ def read_message():
     Returns:
         dict: The parsed JSON message, or None if EOF or parse error
     """
-    raw_length = sys.stdin.buffer.read(4)
-    if len(raw_length) == 0:
-        return None
-    if len(raw_length) < 4:
+    stream = sys.stdin.buffer
+    header = bytearray(_U32.size)
+    if _read_into(stream, header) < _U32.size:
         return None
-    message_length = struct.unpack('<I', raw_length)[0]
+    (message_length,) = _U32.unpack_from(header)
     if message_length == 0:
         return None
-    data = sys.stdin.buffer.read(message_length)
-    if len(data) < message_length:
+    data = bytearray(message_length)
+    if _read_into(stream, data) < message_length:
         return None
     try:
-        return json.loads(data.decode('utf-8'))
-    except Exception:
+        return _json_loads(data)
+    except _JSON_DECODE_ERRORS:
         return None
 
 
@@ -127,13 +206,19 @@ def send_message(msg: dict):
         msg: Dictionary to send as JSON response
     """
     try:
-        encoded = json.dumps(msg).encode('utf-8')
+        encoded = _json_dumps(msg)
     except Exception as e:
         # last resort
-        encoded = json.dumps({"ok": False, "error": f"Failed to encode response: {e}"}).encode('utf-8')
-    sys.stdout.buffer.write(struct.pack('<I', len(encoded)))
-    sys.stdout.buffer.write(encoded)
-    sys.stdout.buffer.flush()
+        encoded = _json_dumps({"ok": False, "error": f"Failed to encode response: {e}"})
+    # Write header and payload in one call so the browser sees a single pipe write
+    out = sys.stdout.buffer
+    out.write(_U32.pack(len(encoded)) + encoded)
+    out.flush()
+
+
+# Use decimal (SI) units as requested: KB, MB, GB, TB
+_BYTE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB')
+_BYTE_SCALES = tuple(1000 ** i for i in range(len(_BYTE_UNITS)))
 
 
 def humanize_bytes(n: int) -> str:
@@ -150,16 +235,11 @@ def humanize_bytes(n: int) -> str:
     """
     if n is None:
         return 'N/A'
-    # Use decimal (SI) units as requested: KB, MB, GB, TB
-    units = ['B', 'KB', 'MB', 'GB', 'TB']
-    v = float(n)
-    i = 0
-    while v >= 1000.0 and i < len(units) - 1:
-        v /= 1000.0
-        i += 1
+    # Unit index: how many SI thresholds n has reached
+    i = bisect.bisect_right(_BYTE_SCALES, n, 1) - 1
     if i == 0:
-        return f"{int(v)} {units[i]}"
-    return f"{v:.2f} {units[i]}"
+        return f"{int(n)} {_BYTE_UNITS[0]}"
+    return f"{n / _BYTE_SCALES[i]:.2f} {_BYTE_UNITS[i]}"
 
 
 def humanize_duration(seconds) -> str:
@@ -173,16 +253,20 @@ def humanize_duration(seconds) -> str:
     """
     if seconds is None:
         return None
-    try:
-        s = int(round(float(seconds)))
-    except Exception:
+    if type(seconds) is int:
+        s = seconds
+    else:
+        try:
+            s = int(round(float(seconds)))
+        except Exception:
+            return None
+    if s < 0:
         return None
-    h = s // 3600
-    m = (s % 3600) // 60
-    sec = s % 60
-    if h > 0:
-        return f"{h:d}:{m:02d}:{sec:02d}"
-    return f"{m:d}:{sec:02d}"
+    h, rem = divmod(s, 3600)
+    m, sec = divmod(rem, 60)
+    if h:
+        return f"{h}:{m:02d}:{sec:02d}"
+    return f"{m}:{sec:02d}"
 
 
 # Resolve paths for a bundled yt-dlp for production reliability
@@ -202,6 +286,7 @@ def _host_dir() -> Path:
         return Path('.')
 
 
+@cache
 def find_yt_dlp() -> str:
     """Locate the yt-dlp executable.
     
@@ -209,8 +294,11 @@ def find_yt_dlp() -> str:
     1. Bundled yt-dlp executable in the same directory (for distributions)
     2. yt-dlp in system PATH
     
+    The result is memoized for the lifetime of the process, so the
+    bundled-executable probe only runs once.
+    
     Returns:
-        str: Path or command name for yt-dlp executable
+        str: Absolute path to yt-dlp, or the bare command name if it could not be resolved
     """
     base = _host_dir()
     # Prefer a bundled yt-dlp executable in the same directory
@@ -224,39 +312,82 @@ def find_yt_dlp() -> str:
                 return str(c)
         except Exception:
             pass
-    # Fallback to PATH
-    return 'yt-dlp'
+    # Fallback to PATH; resolve once so each spawn does not repeat the PATH walk
+    return shutil.which('yt-dlp') or 'yt-dlp'
 
-SIZE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(KiB|MiB|GiB|TiB)")
-ID_RE = re.compile(r"^\s*(\d{3,4})\b")
+# Metadata fields read by the size computation and the cache; everything else is dropped
+_META_KEYS = ('id', 'title', 'duration', 'is_live', 'live_status', 'timestamp')
+_FORMAT_KEYS = ('format_id', 'ext', 'vcodec', 'acodec', 'height', 'fps',
+                'filesize', 'filesize_approx', 'tbr', 'vbr', 'abr')
 
 
-def parse_sizes_from_format_list(text: str):
-    sizes = {"394": None, "395": None, "396": None, "397": None, "398": None, "399": None, "400": None,
-             "299": None, "303": None, "308": None, "251": None}
-    for line in text.splitlines():
-        m_id = ID_RE.match(line)
-        if not m_id:
-            continue
-        fid = m_id.group(1)
-        if fid not in sizes:
-            continue
-        m_sz = SIZE_RE.search(line)
-        if not m_sz:
-            continue
-        num = float(m_sz.group(1))
-        unit = m_sz.group(2)
-        factor = {
-            'KiB': 1024,
-            'MiB': 1024**2,
-            'GiB': 1024**3,
-            'TiB': 1024**4,
-        }[unit]
-        sizes[fid] = int(num * factor)
-    return sizes
-
-
-def run_ytdlp_dump_json(url: str, timeout_sec: int = 25):
+def _slim_metadata(meta):
+    """Reduce yt-dlp metadata to the fields the size computation reads.
+    
+    yt-dlp's -J output is dominated by thumbnails, subtitles, format URLs
+    and HTTP headers that this host never looks at. Keeping only the
+    needed keys lets the rest be freed right after parsing.
+    
+    Args:
+        meta: Parsed yt-dlp JSON (video or playlist)
+        
+    Returns:
+        dict: Metadata with only the consumed keys, or meta unchanged if not a dict
+    """
+    if not isinstance(meta, dict):
+        return meta
+    slim = {k: meta[k] for k in _META_KEYS if k in meta}
+    formats = meta.get('formats')
+    if isinstance(formats, list):
+        slim['formats'] = [
+            {k: f[k] for k in _FORMAT_KEYS if k in f}
+            for f in formats if isinstance(f, dict)
+        ]
+    entries = meta.get('entries')
+    if isinstance(entries, list):
+        slim['entries'] = [_slim_metadata(e) for e in entries]
+    return slim
+
+
+def _spawn_ytdlp(args: List[str], timeout_sec: int) -> subprocess.CompletedProcess:
+    """Run yt-dlp with the given arguments and capture its output as bytes.
+    
+    stdin is redirected to the null device so yt-dlp can never consume
+    native messaging input. On POSIX, close_fds=False lets CPython take the
+    faster posix_spawn path; descriptors the host opens itself are
+    non-inheritable there (PEP 446). On Windows close_fds stays True:
+    otherwise the child inherits every inheritable handle, including the
+    native messaging pipes Chrome passed to the host, which could keep the
+    port open after the host exits.
+    
+    Args:
+        args: Arguments passed to yt-dlp
+        timeout_sec: Maximum execution time in seconds
+        
+    Returns:
+        subprocess.CompletedProcess with bytes stdout/stderr
+        
+    Raises:
+        FileNotFoundError: If yt-dlp cannot be executed
+        subprocess.TimeoutExpired: If yt-dlp runs past the timeout
+    """
+    return subprocess.run(
+        [find_yt_dlp(), *args],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        close_fds=(os.name == 'nt'),
+        timeout=timeout_sec,
+    )
+
+
+# Skip the auto-translated subtitle list, which is a large share of the -J
+# payload. HLS formats are kept: they have no filesize, but their bitrates give
+# size estimates when no DASH formats are offered (e.g. recently ended lives).
+YTDLP_YOUTUBE_EXTRACTOR_ARGS = "youtube:skip=translated_subs"
+
+
+def run_ytdlp_dump_json(url: str, timeout_sec: int = 25, full: bool = False):
     """Run yt-dlp with -J flag to extract complete metadata as JSON.
     
     This is the preferred method for extracting video information as it
@@ -265,6 +396,8 @@ def run_ytdlp_dump_json(url: str, timeout_sec: int = 25):
     Args:
         url: YouTube video URL
         timeout_sec: Maximum execution time in seconds (default: 25)
+        full: Return the complete metadata instead of only the fields
+            used for size computation (default: False)
         
     Returns:
         tuple: (json_dict or None, error_string or None, exit_code)
@@ -278,49 +411,46 @@ def run_ytdlp_dump_json(url: str, timeout_sec: int = 25):
          return None, "Invalid or unsafe YouTube URL", 1
 
     try:
-        yt = find_yt_dlp()
         # use -- to prevent flag injection
-        proc = subprocess.run(
-            [yt, "-J", "-s", "--no-playlist", "--", url],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            timeout=timeout_sec,
-        )
+        proc = _spawn_ytdlp(["-J", "-s", "--no-playlist", "--no-warnings",
+                             "--extractor-args", YTDLP_YOUTUBE_EXTRACTOR_ARGS, "--", url], timeout_sec)
     except FileNotFoundError:
         return None, "yt-dlp not found in PATH. Please install yt-dlp.", 127
     except subprocess.TimeoutExpired:
         return None, "yt-dlp timed out while fetching metadata.", 124
-    out = proc.stdout or ""
-    err = proc.stderr or ""
     if proc.returncode != 0:
+        err = (proc.stderr or b"").decode('utf-8', 'replace')
         return None, err.strip() or f"yt-dlp exited with code {proc.returncode}", proc.returncode
     try:
-        obj = json.loads(out)
+        # Parse the raw bytes directly; no intermediate str decode of the payload
+        obj = _json_loads(proc.stdout or b"")
     except Exception as e:
         return None, f"Failed to parse yt-dlp JSON: {e}", 1
+    if not full:
+        obj = _slim_metadata(obj)
     return obj, None, 0
 
 
-def _get_num(val):
-    """Safely convert a value to float, returning None on error.
+def _get_num(val: Any) -> Optional[Union[int, float]]:
+    """Safely convert a value to a number, returning None on error.
     
     Args:
         val: Value to convert
         
     Returns:
-        float or None
+        int or float (ints and floats are returned unchanged), or None
     """
+    # yt-dlp fields are almost always numbers or None; skip the conversion for
+    # those. Exact type checks keep bool (an int subclass) on the float() path.
+    if val is None or type(val) is float or type(val) is int:
+        return val
     try:
-        if val is None:
-            return None
-        v = float(val)
-        return v
+        return float(val)
     except Exception:
         return None
 
 
-def _filesize_from_fmt(fmt: dict, duration_sec: Optional[int]):
+def _filesize_from_fmt(fmt: dict, duration_sec: Optional[int]) -> Optional[int]:
     """Extract or estimate file size from a yt-dlp format object.
     
     Attempts multiple strategies in order:
@@ -335,32 +465,82 @@ def _filesize_from_fmt(fmt: dict, duration_sec: Optional[int]):
     Returns:
         int: Estimated size in bytes, or None if unable to determine
     """
-    if fmt is None:
+    return _size_from_fmt(fmt, _bytes_per_kbps(duration_sec))
+
+
+def _bytes_per_kbps(duration_sec: Optional[int]) -> float:
+    """Bytes per kbps of bitrate over the whole duration (0.0 if unknown).
+    
+    kbps -> bytes/sec = kbps*1000/8 = kbps*125, so this is 125 * duration.
+    """
+    return 125.0 * duration_sec if duration_sec else 0.0
+
+
+def _size_from_fmt(fmt: dict, est_factor: float) -> Optional[int]:
+    """Core of _filesize_from_fmt with the duration factor precomputed.
+    
+    Args:
+        fmt: Format dictionary from yt-dlp metadata
+        est_factor: Value from _bytes_per_kbps for the video's duration
+        
+    Returns:
+        int: Estimated size in bytes, or None if unable to determine
+    """
+    if not fmt:
         return None
+    get = fmt.get
     # Prefer exact filesize, then approx; else estimate from tbr/vbr/abr and duration
-    for k in ("filesize", "filesize_approx"):
-        v = fmt.get(k)
-        if isinstance(v, (int, float)):
-            try:
-                return int(v)
-            except Exception:
-                pass
-    kbps = None
+    size = get("filesize") or get("filesize_approx")
+    if isinstance(size, (int, float)):
+        return int(size)
+    if not est_factor:
+        return None
+    # yt-dlp reports bitrates as numbers (or None), so no string coercion is needed
     for k in ("tbr", "vbr", "abr"):
-        v = _get_num(fmt.get(k))
-        if v is not None and v > 0:
-            kbps = v
-            break
-    if duration_sec and kbps:
-        try:
-            # kbps -> bytes/sec = (kbps*1000)/8
-            return int((kbps * 1000.0 / 8.0) * float(duration_sec))
-        except Exception:
-            return None
+        kbps = get(k)
+        if isinstance(kbps, (int, float)) and kbps > 0:
+            return int(kbps * est_factor)
     return None
 
 
-def _pick_audio(formats: List[Dict[str, Any]], duration_sec: Optional[int]):
+def _split_formats(formats: List[Dict[str, Any]]) -> Tuple[Dict[str, Dict[str, Any]], List[Dict[str, Any]],
+                                                        List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Index and classify yt-dlp formats in a single pass.
+    
+    Args:
+        formats: List of format dictionaries from yt-dlp
+        
+    Returns:
+        tuple: (by_id, audio_only, video_only, progressive)
+            - by_id: First format for each format_id (as str)
+            - audio_only: Formats with audio and no video
+            - video_only: Formats with video, no audio and a known height
+            - progressive: Formats with both video and audio and a known height
+    """
+    by_id: Dict[str, Dict[str, Any]] = {}
+    audio_only: List[Dict[str, Any]] = []
+    video_only: List[Dict[str, Any]] = []
+    progressive: List[Dict[str, Any]] = []
+    for f in formats:
+        if not isinstance(f, dict):
+            continue
+        fid = f.get('format_id')
+        if fid is not None:
+            by_id.setdefault(str(fid), f)
+        vcodec = (f.get('vcodec') or '').lower()
+        acodec = (f.get('acodec') or '').lower()
+        if vcodec == 'none':
+            if acodec != 'none':
+                audio_only.append(f)
+            continue
+        h = f.get('height')
+        if isinstance(h, int) and h > 0:
+            (video_only if acodec == 'none' else progressive).append(f)
+    return by_id, audio_only, video_only, progressive
+
+
+def _pick_audio(cands: List[Dict[str, Any]],
+                size_of: Callable[[dict], Optional[int]]) -> Tuple[Optional[dict], Optional[int]]:
     """Select the best audio-only format from available formats.
     
     Prefers audio tracks in this order:
@@ -371,18 +551,12 @@ def _pick_audio(formats: List[Dict[str, Any]], duration_sec: Optional[int]):
     Also prefers formats with known file sizes.
     
     Args:
-        formats: List of format dictionaries from yt-dlp
-        duration_sec: Video duration for size estimation
+        cands: Audio-only format dictionaries from _split_formats
+        size_of: Returns the (possibly estimated) size of a format
         
     Returns:
         tuple: (format_dict or None, size_in_bytes or None)
     """
-    cands = []
-    for f in formats or []:
-        acodec = (f.get('acodec') or '').lower()
-        vcodec = (f.get('vcodec') or '').lower()
-        if vcodec == 'none' and acodec != 'none':
-            cands.append(f)
     if not cands:
         return None, None
     def score(f):
@@ -392,14 +566,17 @@ def _pick_audio(formats: List[Dict[str, Any]], duration_sec: Optional[int]):
         if 'opus' in ac: s += 3
         if ext == 'webm': s += 1
         if 'aac' in ac or ext == 'm4a': s += 2
-        if _filesize_from_fmt(f, duration_sec) is not None: s += 2
+        if size_of(f) is not None: s += 2
         return s, _get_num(f.get('abr')) or 0.0
     best = max(cands, key=score)
-    return best, _filesize_from_fmt(best, duration_sec)
+    return best, size_of(best)
 
 
-def _pick_video_by_height(formats: List[Dict[str, Any]], target_h: int, duration_sec: Optional[int]):
-    """Select the best video-only format matching a target height.
+def _best_by_height(cands: List[Dict[str, Any]], target_h: int,
+                    size_of: Callable[[dict], Optional[int]]) -> Tuple[Optional[dict], Optional[int]]:
+    """Select the best format matching a target height.
+    
+    Used for both video-only and progressive formats.
     
     Selection strategy:
     1. Prefer exact height match
@@ -412,105 +589,54 @@ def _pick_video_by_height(formats: List[Dict[str, Any]], target_h: int, duration
     - Higher frame rate
     
     Args:
-        formats: List of format dictionaries from yt-dlp
+        cands: Formats with a known height, from _split_formats
         target_h: Target height in pixels (e.g., 720, 1080)
-        duration_sec: Video duration for size estimation
+        size_of: Returns the (possibly estimated) size of a format
         
     Returns:
         tuple: (format_dict or None, size_in_bytes or None)
     """
-    videos = []
-    for f in formats or []:
-        vcodec = (f.get('vcodec') or '').lower()
-        acodec = (f.get('acodec') or '').lower()
-        if vcodec != 'none' and acodec == 'none':
-            h = f.get('height')
-            if isinstance(h, int) and h > 0:
-                videos.append(f)
-    if not videos:
-        return None, None
-    exact = [f for f in videos if f.get('height') == target_h]
-    if exact:
-        # among exact, prefer one with known filesize; else higher tbr
-        def key1(f):
-            size = _filesize_from_fmt(f, duration_sec)
-            has = 1 if size is not None else 0
-            tbr = _get_num(f.get('tbr')) or 0.0
-            return (has, tbr, f.get('fps') or 0)
-        best = sorted(exact, key=key1, reverse=True)[0]
-        return best, _filesize_from_fmt(best, duration_sec)
-    below = [f for f in videos if isinstance(f.get('height'), int) and f.get('height') < target_h]
-    if below:
-        # choose the maximum height below target
-        mh = max(f.get('height') for f in below)
-        cands = [f for f in below if f.get('height') == mh]
-        def key2(f):
-            size = _filesize_from_fmt(f, duration_sec)
-            has = 1 if size is not None else 0
-            tbr = _get_num(f.get('tbr')) or 0.0
-            return (has, tbr, f.get('fps') or 0)
-        best = sorted(cands, key=key2, reverse=True)[0]
-        return best, _filesize_from_fmt(best, duration_sec)
-    above = [f for f in videos if isinstance(f.get('height'), int) and f.get('height') > target_h]
-    if above:
-        mh = min(f.get('height') for f in above)
-        cands = [f for f in above if f.get('height') == mh]
-        def key3(f):
-            size = _filesize_from_fmt(f, duration_sec)
-            has = 1 if size is not None else 0
-            tbr = _get_num(f.get('tbr')) or 0.0
-            return (has, tbr, f.get('fps') or 0)
-        best = sorted(cands, key=key3, reverse=True)[0]
-        return best, _filesize_from_fmt(best, duration_sec)
-    return None, None
-
-
-def _pick_progressive_by_height(formats: List[Dict[str, Any]], target_h: int, duration_sec: Optional[int]):
-    progs = []
-    for f in formats or []:
-        vcodec = (f.get('vcodec') or '').lower()
-        acodec = (f.get('acodec') or '').lower()
-        if vcodec != 'none' and acodec != 'none':
-            h = f.get('height')
-            if isinstance(h, int) and h > 0:
-                progs.append(f)
-    if not progs:
+    def rank(f):
+        has = 1 if size_of(f) is not None else 0
+        tbr = _get_num(f.get('tbr')) or 0.0
+        return (has, tbr, f.get('fps') or 0)
+
+    # One pass keeps a running best for the exact height, the tallest height
+    # below target and the shortest height above it
+    exact = exact_rank = None
+    below = below_h = below_rank = None
+    above = above_h = above_rank = None
+    for f in cands:
+        h = f.get('height')
+        if h == target_h:
+            r = rank(f)
+            if exact is None or r > exact_rank:
+                exact, exact_rank = f, r
+        elif exact is not None:
+            # an exact match always wins, so fallbacks need no more tracking
+            continue
+        elif h < target_h:
+            if below is None or h > below_h:
+                below, below_h, below_rank = f, h, rank(f)
+            elif h == below_h:
+                r = rank(f)
+                if r > below_rank:
+                    below, below_rank = f, r
+        elif above is None or h < above_h:
+            above, above_h, above_rank = f, h, rank(f)
+        elif h == above_h:
+            r = rank(f)
+            if r > above_rank:
+                above, above_rank = f, r
+
+    best = exact if exact is not None else below if below is not None else above
+    if best is None:
         return None, None
-    exact = [f for f in progs if f.get('height') == target_h]
-    if exact:
-        def keyp1(f):
-            size = _filesize_from_fmt(f, duration_sec)
-            has = 1 if size is not None else 0
-            tbr = _get_num(f.get('tbr')) or 0.0
-            return (has, tbr, f.get('fps') or 0)
-        best = sorted(exact, key=keyp1, reverse=True)[0]
-        return best, _filesize_from_fmt(best, duration_sec)
-    below = [f for f in progs if isinstance(f.get('height'), int) and f.get('height') < target_h]
-    if below:
-        mh = max(f.get('height') for f in below)
-        cands = [f for f in below if f.get('height') == mh]
-        def keyp2(f):
-            size = _filesize_from_fmt(f, duration_sec)
-            has = 1 if size is not None else 0
-            tbr = _get_num(f.get('tbr')) or 0.0
-            return (has, tbr, f.get('fps') or 0)
-        best = sorted(cands, key=keyp2, reverse=True)[0]
-        return best, _filesize_from_fmt(best, duration_sec)
-    above = [f for f in progs if isinstance(f.get('height'), int) and f.get('height') > target_h]
-    if above:
-        mh = min(f.get('height') for f in above)
-        cands = [f for f in above if f.get('height') == mh]
-        def keyp3(f):
-            size = _filesize_from_fmt(f, duration_sec)
-            has = 1 if size is not None else 0
-            tbr = _get_num(f.get('tbr')) or 0.0
-            return (has, tbr, f.get('fps') or 0)
-        best = sorted(cands, key=keyp3, reverse=True)[0]
-        return best, _filesize_from_fmt(best, duration_sec)
-    return None, None
-
-
-def compute_sizes_from_json_all(meta: dict, duration_hint: Optional[int] = None):
+    return best, size_of(best)
+
+
+def compute_sizes_from_json_all(meta: dict, duration_hint: Optional[int] = None) -> Tuple[
+        Dict[str, Optional[int]], Dict[str, Optional[int]], Optional[int], Optional[int]]:
     """Compute video sizes for all resolutions from yt-dlp JSON metadata.
     
     Analyzes the complete metadata to extract sizes for:
@@ -538,18 +664,11 @@ def compute_sizes_from_json_all(meta: dict, duration_hint: Optional[int] = None)
     """
     if not isinstance(meta, dict):
         return {}, {}, None, None
-    # Handle playlist structures: pick first entry with formats
-    try:
-        if 'entries' in meta and isinstance(meta['entries'], list) and meta['entries']:
-            for e in meta['entries']:
-                if isinstance(e, dict) and e.get('formats'):
-                    meta = e
-                    break
-            else:
-                if isinstance(meta['entries'][0], dict):
-                    meta = meta['entries'][0]
-    except Exception:
-        pass
+    # -J runs with --no-playlist, so a playlist wrapper is not expected; if one
+    # shows up anyway, use its first entry
+    entries = meta.get('entries')
+    if isinstance(entries, list) and entries and isinstance(entries[0], dict):
+        meta = entries[0]
 
     duration_sec = None
     try:
@@ -563,13 +682,18 @@ def compute_sizes_from_json_all(meta: dict, duration_hint: Optional[int] = None)
         _dbg(f"using duration_hint in JSON compute: {duration_hint}")
         duration_sec = duration_hint
 
-    def fmt_by_id(fid: str):
-        for f in (meta.get('formats') or []):
-            if str(f.get('format_id')) == fid:
-                return f
-        return None
+    # Index and classify the formats once; every lookup below reuses these
+    by_id, audio_fmts, video_fmts, prog_fmts = _split_formats(meta.get('formats') or [])
+    size_memo: Dict[int, Optional[int]] = {}
+    est_factor = _bytes_per_kbps(duration_sec)
 
-    def size_for(f):
+    def size_of(f: dict) -> Optional[int]:
+        key = id(f)
+        if key not in size_memo:
+            size_memo[key] = _size_from_fmt(f, est_factor)
+        return size_memo[key]
+
+    def size_for(f: Optional[dict]) -> Optional[int]:
         if not f:
             return None
         s = f.get('filesize')
@@ -580,11 +704,10 @@ def compute_sizes_from_json_all(meta: dict, duration_hint: Optional[int] = None)
             return int(s)
         return None
 
-    formats = meta.get('formats') or []
     # Audio: prefer explicit 251 size; else pick best audio
-    a251_b = size_for(fmt_by_id('251'))
+    a251_b = size_for(by_id.get('251'))
     if a251_b is None:
-        _afmt, audio_fb = _pick_audio(formats, duration_sec)
+        _afmt, audio_fb = _pick_audio(audio_fmts, size_of)
     else:
         audio_fb = None
     audio_b = a251_b if a251_b is not None else audio_fb
@@ -596,10 +719,10 @@ def compute_sizes_from_json_all(meta: dict, duration_hint: Optional[int] = None)
 
     for h, fid in heights:
         # exact id size if present
-        v_exact_b = size_for(fmt_by_id(fid))
+        v_exact_b = size_for(by_id.get(fid))
         # pick by height otherwise
         if v_exact_b is None:
-            _vf, v_b = _pick_video_by_height(formats, h, duration_sec)
+            _vf, v_b = _best_by_height(video_fmts, h, size_of)
         else:
             v_b = v_exact_b
         # record video-only as best known for that height/id
@@ -612,80 +735,365 @@ def compute_sizes_from_json_all(meta: dict, duration_hint: Optional[int] = None)
             sizes[s_key] = int(v_b + audio_b)
         else:
             # Progressive fallback
-            _pf, p_b = _pick_progressive_by_height(formats, h, duration_sec)
+            _pf, p_b = _best_by_height(prog_fmts, h, size_of)
             if p_b is not None:
                 sizes[s_key] = int(p_b)
 
     # Also capture explicit 1080p/1440p variant itags if available (video-only bytes)
-    f299 = fmt_by_id('299')
-    f303 = fmt_by_id('303')
-    f308 = fmt_by_id('308')
-    video_only['v299'] = _filesize_from_fmt(f299, duration_sec) if f299 else None
-    video_only['v303'] = _filesize_from_fmt(f303, duration_sec) if f303 else None
-    video_only['v308'] = _filesize_from_fmt(f308, duration_sec) if f308 else None
+    f299 = by_id.get('299')
+    f303 = by_id.get('303')
+    f308 = by_id.get('308')
+    video_only['v299'] = size_of(f299) if f299 else None
+    video_only['v303'] = size_of(f303) if f303 else None
+    video_only['v308'] = size_of(f308) if f308 else None
 
     return sizes, video_only, a251_b, duration_sec
 
 
-def run_ytdlp_list_formats(url: str, timeout_sec: int = 25):
+# YouTube InnerTube player endpoint, used for lightweight lookups without spawning yt-dlp
+INNERTUBE_PLAYER_URL = 'https://www.youtube.com/youtubei/v1/player?prettyPrint=false'
+# Version of the YouTube Android app the requests claim to come from. YouTube
+# rejects or degrades outdated clients; when this default falls behind, set
+# YTDLP_HOST_INNERTUBE_CLIENT_VERSION to a newer app version without a release.
+INNERTUBE_CLIENT_VERSION = os.environ.get('YTDLP_HOST_INNERTUBE_CLIENT_VERSION') or '19.44.38'
+INNERTUBE_ANDROID_SDK_VERSION = 30
+INNERTUBE_USER_AGENT = f'com.google.android.youtube/{INNERTUBE_CLIENT_VERSION} (Linux; U; Android 11) gzip'
+INNERTUBE_CLIENT = {
+    'clientName': 'ANDROID',
+    'clientVersion': INNERTUBE_CLIENT_VERSION,
+    'androidSdkVersion': INNERTUBE_ANDROID_SDK_VERSION,
+    'osName': 'Android',
+    'osVersion': '11',
+    'userAgent': INNERTUBE_USER_AGENT,
+    'hl': 'en',
+}
+INNERTUBE_HEADERS = {
+    'Content-Type': 'application/json',
+    'User-Agent': INNERTUBE_USER_AGENT,
+    # 3 is InnerTube's numeric id for the ANDROID client
+    'X-YouTube-Client-Name': '3',
+    'X-YouTube-Client-Version': INNERTUBE_CLIENT_VERSION,
+}
+INNERTUBE_TIMEOUT_SEC = 5
+
+# Total time a request may spend on InnerTube plus yt-dlp; kept below the
+# extension's 30 s native host timeout so a slow yt-dlp is reported as such
+REQUEST_BUDGET_SEC = 25
+# Shortest yt-dlp timeout worth attempting once InnerTube used up its share
+YTDLP_MIN_TIMEOUT_SEC = 5
+
+
+def _innertube_player(vid: str, timeout_sec: int) -> dict:
+    """POST a player request for a video to the InnerTube API.
+    
+    Args:
+        vid: YouTube video ID
+        timeout_sec: Request timeout in seconds
+        
+    Returns:
+        dict: Parsed player response
+
+    Raises:
+        Exception: On network, HTTP or decode errors
+    """
+    body = _json_dumps({'context': {'client': INNERTUBE_CLIENT}, 'videoId': vid})
+    req = urllib.request.Request(INNERTUBE_PLAYER_URL, data=body, headers=INNERTUBE_HEADERS)
+    with urllib.request.urlopen(req, timeout=timeout_sec) as resp:
+        return _json_loads(resp.read())
+
+
+def _fetch_duration_innertube(vid: Optional[str], timeout_sec: int = INNERTUBE_TIMEOUT_SEC) -> Optional[int]:
+    """Fetch a video's duration from YouTube's InnerTube player API.
+    
+    A single HTTPS request is much cheaper than another yt-dlp run, so this
+    is used when cached metadata lacks the duration and no hint was provided.
+    
+    Args:
+        vid: YouTube video ID
+        timeout_sec: Request timeout in seconds (default: INNERTUBE_TIMEOUT_SEC)
+        
+    Returns:
+        int: Duration in seconds, or None on any failure
+    """
+    if not vid:
+        return None
     try:
-        yt = find_yt_dlp()
-        # use -- to prevent flag injection
-        proc = subprocess.run(
-            [yt, "-F", "--no-playlist", "--", url],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            timeout=timeout_sec,
-        )
-    except FileNotFoundError:
-        return None, "yt-dlp not found in PATH. Please install yt-dlp.", 127
-    except subprocess.TimeoutExpired:
-        return None, "yt-dlp timed out while listing formats.", 124
-    out = proc.stdout or ""
-    err = proc.stderr or ""
-    if proc.returncode != 0:
-        return out, err.strip() or f"yt-dlp exited with code {proc.returncode}", proc.returncode
-    return out, None, 0
+        secs = int(_innertube_player(vid, timeout_sec)['videoDetails']['lengthSeconds'])
+        return secs if secs > 0 else None
+    except Exception as e:
+        _dbg(f"InnerTube duration fetch failed: {e}")
+        return None
+
+
+def _innertube_format(f: dict, progressive: bool) -> dict:
+    """Convert an InnerTube streamingData format to yt-dlp's format shape.
+    
+    Args:
+        f: Entry from streamingData.formats or streamingData.adaptiveFormats
+        progressive: True for muxed (audio+video) formats
+        
+    Returns:
+        dict: Format with the keys compute_sizes_from_json_all reads
+    """
+    mime = f.get('mimeType') or ''
+    kind, _, rest = mime.partition('/')
+    ext, _, params = rest.partition(';')
+    codecs = params.partition('codecs=')[2].strip().strip('"')
+    kbps = (f.get('averageBitrate') or f.get('bitrate') or 0) / 1000.0 or None
+    out = {'format_id': str(f.get('itag')), 'tbr': kbps}
+    if kind == 'audio':
+        out.update(vcodec='none', acodec=codecs or 'unknown', abr=kbps,
+                   ext='m4a' if ext == 'mp4' else ext)
+    else:
+        vcodec, _, acodec = codecs.partition(',')
+        out.update(vcodec=vcodec.strip() or 'unknown', ext=ext,
+                   acodec=(acodec.strip() or 'unknown') if progressive else 'none',
+                   height=f.get('height'), fps=f.get('fps'))
+    if f.get('contentLength'):
+        out['filesize'] = int(f['contentLength'])
+    return out
+
+
+def _innertube_publish_timestamp(data: dict) -> Optional[int]:
+    """Get a video's publish time from an InnerTube player response.
+    
+    Args:
+        data: Parsed player response
+        
+    Returns:
+        int: Unix timestamp of the publish (or upload) date, or None if the
+            response has no parsable date (the ANDROID client often omits it)
+    """
+    micro = (data.get('microformat') or {}).get('playerMicroformatRenderer') or {}
+    value = micro.get('publishDate') or micro.get('uploadDate')
+    if not isinstance(value, str):
+        return None
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
 
 
-def run_ytdlp_get_duration(url: str, timeout_sec: int = 20):
-    """Return (duration_seconds:int|None, err:str|None, code:int)"""
-    # Use --print to directly output the duration in seconds if available
+def _fetch_player_innertube(vid: Optional[str], timeout_sec: int = INNERTUBE_TIMEOUT_SEC):
+    """Fetch format metadata from the InnerTube player API instead of yt-dlp.
+    
+    The ANDROID client returns direct format URLs with a contentLength per
+    format, so sizes are available without running yt-dlp's extractor.
+    The metadata is shaped like (slimmed) yt-dlp -J output.
+    
+    Args:
+        vid: YouTube video ID
+        timeout_sec: Request timeout in seconds (default: INNERTUBE_TIMEOUT_SEC)
+        
+    Returns:
+        tuple: (metadata, duration_sec)
+            - metadata: Dict with 'id', 'duration' and 'formats', or None if
+              the video is not playable, has no sized formats, or the request fails
+            - duration_sec: videoDetails.lengthSeconds when the response had it,
+              even if the formats were unusable; None otherwise
+    """
+    if not vid:
+        return None, None
     try:
-        yt = find_yt_dlp()
-        # use -- to prevent flag injection
-        proc = subprocess.run(
-            [yt, "--print", "%(duration)s", "-s", "--no-playlist", "--", url],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            timeout=timeout_sec,
-        )
-    except FileNotFoundError:
-        return None, "yt-dlp not found in PATH. Please install yt-dlp.", 127
-    except subprocess.TimeoutExpired:
-        return None, "yt-dlp timed out while fetching duration.", 124
-    out = (proc.stdout or "").strip()
-    if proc.returncode != 0:
-        return None, (proc.stderr or "").strip() or f"yt-dlp exited with code {proc.returncode}", proc.returncode
-    # Sometimes duration may be empty/NA
+        data = _innertube_player(vid, timeout_sec)
+    except Exception as e:
+        _dbg(f"InnerTube player fetch failed: {e}")
+        return None, None
     try:
-        if out:
-            val = int(float(out))
-        else:
-            val = None
+        secs = int((data.get('videoDetails') or {}).get('lengthSeconds') or 0)
+    except (TypeError, ValueError):
+        secs = 0
+    duration = secs if secs > 0 else None
+    try:
+        if (data.get('playabilityStatus') or {}).get('status') != 'OK':
+            return None, duration
+        streaming = data.get('streamingData') or {}
+        formats = [_innertube_format(f, True) for f in streaming.get('formats') or []]
+        formats += [_innertube_format(f, False) for f in streaming.get('adaptiveFormats') or []]
+    except Exception as e:
+        _dbg(f"InnerTube player response not usable: {e}")
+        return None, duration
+    if not any('filesize' in f for f in formats):
+        return None, duration
+    meta = {'id': vid, 'duration': duration, 'formats': formats}
+    timestamp = _innertube_publish_timestamp(data)
+    if timestamp is not None:
+        meta['timestamp'] = timestamp
+    details = data.get('videoDetails') or {}
+    if details.get('isUpcoming'):
+        meta['live_status'] = 'is_upcoming'
+    elif details.get('isLive'):
+        meta['live_status'] = 'is_live'
+    elif details.get('isPostLiveDvr'):
+        meta['live_status'] = 'post_live'
+    return meta, duration
+
+
+# On-disk cache of yt-dlp metadata, keyed by video ID
+META_CACHE_TTL_SEC = 24 * 3600
+META_CACHE_MAX_ENTRIES = 500
+# Higher resolutions of new uploads are often still processing, so their
+# format lists (and any without a known upload time) are only trusted briefly
+META_CACHE_RECENT_UPLOAD_SEC = 2 * 24 * 3600
+META_CACHE_RECENT_TTL_SEC = 3600
+# Live, upcoming and just-ended streams change formats too quickly to cache
+UNCACHEABLE_LIVE_STATUSES = ('is_live', 'is_upcoming', 'post_live')
+
+
+def _cache_dir() -> Path:
+    """Get the per-user directory for cached yt-dlp metadata.
+    
+    The host directory may not be writable (e.g. a system-wide install),
+    so the cache lives in the user's cache location instead.
+    
+    Returns:
+        Path to the cache directory (may not exist yet)
+    """
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or str(Path.home() / 'AppData' / 'Local')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or str(Path.home() / '.cache')
+    return Path(base) / 'ytdlp-sizer' / 'meta'
+
+
+def _cache_ttl(meta: dict) -> int:
+    """Get how long metadata for a video may be cached.
+    
+    Args:
+        meta: Metadata about to be cached
+        
+    Returns:
+        int: TTL in seconds, or 0 if the metadata should not be cached
+    """
+    if meta.get('is_live') or meta.get('live_status') in UNCACHEABLE_LIVE_STATUSES:
+        return 0
+    ts = meta.get('timestamp')
+    # Without a known upload time the video may be brand new, so trust it briefly
+    if not isinstance(ts, (int, float)) or time.time() - ts < META_CACHE_RECENT_UPLOAD_SEC:
+        return META_CACHE_RECENT_TTL_SEC
+    return META_CACHE_TTL_SEC
+
+
+def _cache_get(vid: Optional[str]):
+    """Load cached metadata for a video if present and not expired.
+    
+    A hit refreshes the entry's mtime, so eviction drops the least
+    recently used entries first.
+    
+    Args:
+        vid: YouTube video ID
+        
+    Returns:
+        dict: Cached metadata, or None on miss, expiry, or read error
+    """
+    if not vid:
+        return None
+    try:
+        path = _cache_dir() / f"{vid}.json"
+        entry = _json_loads(path.read_bytes())
+        if not isinstance(entry, dict) or time.time() > entry.get('expires', 0):
+            return None
+        meta = entry.get('meta')
+        if not isinstance(meta, dict):
+            return None
+        os.utime(path)
     except Exception:
-        val = None
-    return val, None, 0
+        return None
+    return meta
 
 
-def main():
-    _dbg("start")
-    req = read_message()
-    if req is None:
-        _dbg("no request received; exiting")
+def _cache_put(vid: Optional[str], meta: dict):
+    """Store metadata for a video, evicting the least recently used entries past the cap.
+    
+    Entries record their own expiry (see _cache_ttl); live and upcoming
+    streams are not stored. Writes go through a temporary file and an
+    atomic rename so a concurrently running host never reads a partial
+    entry. Failures are logged and otherwise ignored; the cache is only an
+    optimization.
+    
+    Args:
+        vid: YouTube video ID
+        meta: Metadata to cache
+    """
+    if not vid:
+        return
+    ttl = _cache_ttl(meta)
+    if ttl <= 0:
+        _dbg(f"not caching live metadata for {vid}")
         return
+    try:
+        d = _cache_dir()
+        d.mkdir(parents=True, exist_ok=True)
+        tmp = d / f"{vid}.{os.getpid()}.tmp"
+        tmp.write_bytes(_json_dumps({'expires': time.time() + ttl, 'meta': meta}))
+        os.replace(tmp, d / f"{vid}.json")
+        entries = list(d.glob('*.json'))
+        if len(entries) > META_CACHE_MAX_ENTRIES:
+            entries.sort(key=lambda p: p.stat().st_mtime)
+            for p in entries[:len(entries) - META_CACHE_MAX_ENTRIES]:
+                p.unlink(missing_ok=True)
+    except Exception as e:
+        _dbg(f"metadata cache write failed: {e}")
+
+
+# Response keys, in the order the extension has always received them
+RESPONSE_SIZE_KEYS = ('s144p', 's240p', 's360p', 's480p', 's720p', 's1080p', 's1440p')
+RESPONSE_VIDEO_ONLY_KEYS = ('v394', 'v395', 'v396', 'v397', 'v398', 'v399', 'v400', 'v299', 'v303', 'v308')
+# Codec variant key -> video-only format it combines with 251 audio
+RESPONSE_VARIANT_KEYS = (('s1080p_299', 'v299'), ('s1080p_303', 'v303'), ('s1080p_399', 'v399'),
+                         ('s1440p_308', 'v308'), ('s1440p_400', 'v400'))
+# Keys that carry a full download size (video + audio); also humanized
+RESPONSE_COMBINED_KEYS = RESPONSE_SIZE_KEYS + tuple(k for k, _ in RESPONSE_VARIANT_KEYS)
+
+
+def _response_sizes(meta: Optional[dict], duration_hint: Optional[int]) -> Tuple[
+        Dict[str, Optional[int]], Optional[int]]:
+    """Build the response's byte sizes from metadata.
+    
+    Args:
+        meta: Metadata from the cache, InnerTube or yt-dlp, or None
+        duration_hint: Optional duration in seconds from the request
+        
+    Returns:
+        tuple: (byte_sizes, duration_sec)
+            - byte_sizes: Sizes keyed like the response's 'bytes' dict (all None without metadata)
+            - duration_sec: Duration from the metadata or the hint, or None
+    """
+    sizes_by_h: Dict[str, Optional[int]] = {}
+    video_only_by_id: Dict[str, Optional[int]] = {}
+    a251 = None
+    dur_sec = None
+    if meta:
+        sizes_by_h, video_only_by_id, a251, dur_sec = compute_sizes_from_json_all(meta, duration_hint)
+
+    byte_sizes: Dict[str, Optional[int]] = {k: sizes_by_h.get(k) for k in RESPONSE_SIZE_KEYS}
+    for k in RESPONSE_VIDEO_ONLY_KEYS:
+        byte_sizes[k] = video_only_by_id.get(k)
+    # Codec variants are only reported combined with 251 audio
+    for k, v_key in RESPONSE_VARIANT_KEYS:
+        v = video_only_by_id.get(v_key)
+        byte_sizes[k] = (v + a251) if (v is not None and a251 is not None) else None
+    byte_sizes['a251'] = a251
+    return byte_sizes, dur_sec
+
+
+def _has_sizes(byte_sizes: Dict[str, Optional[int]]) -> bool:
+    """Check whether any full download size (video + audio) is known."""
+    return any(byte_sizes[k] is not None for k in RESPONSE_COMBINED_KEYS)
+
+
+def handle_request(req) -> dict:
+    """Compute the size response for a single native messaging request.
+    
+    Args:
+        req: Parsed request message with 'url' and optional 'duration_hint'
+        
+    Returns:
+        dict: Response message to send back to the extension
+    """
     url = req.get('url') if isinstance(req, dict) else None
     duration_hint = None
     try:
@@ -700,168 +1108,91 @@ def main():
         _dbg(f"duration_hint received: {duration_hint}")
     if not url:
         _dbg("request missing 'url'")
-        send_message({"ok": False, "error": "No URL provided."})
-        return
-
-    # Prefer a single JSON call to get sizes and duration; fall back to -F only if needed
-    _dbg("running yt-dlp -J ...")
-    meta, j_err, j_code = run_ytdlp_dump_json(url)
-    s144 = s240 = s360 = s480 = s720 = s1080 = s1440 = None
-    v144 = v240 = v360 = v480 = v720 = v1080 = v1440 = None
-    v1080_299 = v1080_303 = v1080_399 = None
-    v1440_308 = v1440_400 = None
-    s1080_299 = s1080_303 = s1080_399 = None
-    s1440_308 = s1440_400 = None
-    a251 = None
-    dur_sec = None
-    # Track fallback (-F) and duration errors explicitly
-    f_err = None
-    f_code = None
-    d_err = None
-    d_code = None
-
-    if j_code == 0 and meta:
-        sizes_by_h, video_only_by_id, a251_b, dur_sec = compute_sizes_from_json_all(meta, duration_hint)
-        s144 = sizes_by_h.get('s144p')
-        s240 = sizes_by_h.get('s240p')
-        s360 = sizes_by_h.get('s360p')
-        s480 = sizes_by_h.get('s480p')
-        s720 = sizes_by_h.get('s720p')
-        s1080 = sizes_by_h.get('s1080p')
-        s1440 = sizes_by_h.get('s1440p')
-        v144 = video_only_by_id.get('v394')
-        v240 = video_only_by_id.get('v395')
-        v360 = video_only_by_id.get('v396')
-        v480 = video_only_by_id.get('v397')
-        v720 = video_only_by_id.get('v398')
-        v1080 = video_only_by_id.get('v399')
-        v1440 = video_only_by_id.get('v400')
-        v1080_299 = video_only_by_id.get('v299')
-        v1080_303 = video_only_by_id.get('v303')
-        v1080_399 = video_only_by_id.get('v399')
-        v1440_308 = video_only_by_id.get('v308')
-        v1440_400 = video_only_by_id.get('v400')
-        a251 = a251_b
-        # Combine with 251 audio if available
-        if a251 is not None:
-            s1080_299 = (v1080_299 + a251) if v1080_299 is not None else None
-            s1080_303 = (v1080_303 + a251) if v1080_303 is not None else None
-            s1080_399 = (v1080_399 + a251) if v1080_399 is not None else None
-            s1440_308 = (v1440_308 + a251) if v1440_308 is not None else None
-            s1440_400 = (v1440_400 + a251) if v1440_400 is not None else None
-
-    # If still missing everything, try -F as a fallback
-    if all(x is None for x in [s144, s240, s360, s480, s720, s1080, s1440]):
-        _dbg("sizes not found in -J; trying -F ...")
-        out, f_err, f_code = run_ytdlp_list_formats(url)
-        if f_code == 0 and out:
-            sizes = parse_sizes_from_format_list(out)
-            v144 = sizes.get("394")
-            v240 = sizes.get("395")
-            v360 = sizes.get("396")
-            v480 = sizes.get("397")
-            v720 = sizes.get("398")
-            v1080 = sizes.get("399")
-            v1440 = sizes.get("400")
-            v1080_299 = sizes.get("299")
-            v1080_303 = sizes.get("303")
-            v1080_399 = sizes.get("399")
-            v1440_308 = sizes.get("308")
-            v1440_400 = sizes.get("400")
-            a251 = sizes.get("251")
-            s144 = (v144 + a251) if (v144 is not None and a251 is not None) else None
-            s240 = (v240 + a251) if (v240 is not None and a251 is not None) else None
-            s360 = (v360 + a251) if (v360 is not None and a251 is not None) else None
-            s480 = (v480 + a251) if (v480 is not None and a251 is not None) else None
-            s720 = (v720 + a251) if (v720 is not None and a251 is not None) else None
-            s1080 = (v1080 + a251) if (v1080 is not None and a251 is not None) else None
-            s1440 = (v1440 + a251) if (v1440 is not None and a251 is not None) else None
-            s1080_299 = (v1080_299 + a251) if (v1080_299 is not None and a251 is not None) else None
-            s1080_303 = (v1080_303 + a251) if (v1080_303 is not None and a251 is not None) else None
-            s1080_399 = (v1080_399 + a251) if (v1080_399 is not None and a251 is not None) else None
-            s1440_308 = (v1440_308 + a251) if (v1440_308 is not None and a251 is not None) else None
-            s1440_400 = (v1440_400 + a251) if (v1440_400 is not None and a251 is not None) else None
-
-    # Duration if still missing and no valid hint provided
-    if dur_sec is None and not (isinstance(duration_hint, int) and duration_hint > 0):
-        _dbg("fetching duration ...")
-        dur_sec, d_err, d_code = run_ytdlp_get_duration(url)
-        if d_code != 0:
-            _dbg(f"duration fetch failed code={d_code} err={(d_err or '')[:200]}")
-    elif dur_sec is None and isinstance(duration_hint, int) and duration_hint > 0:
-        _dbg("skipping duration fetch due to valid duration_hint")
-        dur_sec = duration_hint
-
-    dur_h = humanize_duration(dur_sec)
+        return {"ok": False, "error": "No URL provided."}
+
+    # Sizes and duration all come from a single metadata lookup
+    started = time.monotonic()
+    vid = extract_video_id(url)
+    meta = _cache_get(vid)
+    player_fetched = False
+    player_dur = None
+    j_err, j_code = None, 0
+    if meta is not None:
+        _dbg(f"metadata cache hit for {vid}")
+        byte_sizes, dur_sec = _response_sizes(meta, duration_hint)
+    else:
+        # A single InnerTube request is far cheaper than spawning yt-dlp;
+        # yt-dlp remains the fallback whenever InnerTube yields no sizes
+        meta, player_dur = _fetch_player_innertube(vid)
+        player_fetched = True
+        byte_sizes, dur_sec = _response_sizes(meta, duration_hint)
+        if meta is not None and _has_sizes(byte_sizes):
+            _dbg("using InnerTube formats")
+        else:
+            if meta is not None:
+                _dbg("InnerTube formats gave no sizes; falling back to yt-dlp")
+            # Give yt-dlp whatever InnerTube left of the request budget
+            remaining = REQUEST_BUDGET_SEC - (time.monotonic() - started)
+            timeout_sec = max(YTDLP_MIN_TIMEOUT_SEC, int(remaining))
+            _dbg(f"running yt-dlp -J (timeout {timeout_sec}s) ...")
+            meta, j_err, j_code = run_ytdlp_dump_json(url, timeout_sec=timeout_sec)
+            byte_sizes, dur_sec = _response_sizes(meta if j_code == 0 else None, duration_hint)
+        # Only metadata that produced sizes is worth serving again
+        if _has_sizes(byte_sizes):
+            _cache_put(vid, meta)
 
     # If we still have no sizes at all, treat this as an error and report why.
-    has_any_size = any(x is not None for x in [
-        s144, s240, s360, s480, s720, s1080, s1440,
-        s1080_299, s1080_303, s1080_399, s1440_308, s1440_400
-    ])
-    if not has_any_size:
+    if not _has_sizes(byte_sizes):
         # Prioritize clear causes
-        if j_code == 127 or f_code == 127:
-            send_message({"ok": False, "error": "yt-dlp not found in PATH. Please install yt-dlp."})
-            return
-        if j_code == 124 or f_code == 124:
-            send_message({"ok": False, "error": "yt-dlp timed out while fetching data."})
-            return
+        if j_code == 127:
+            return {"ok": False, "error": "yt-dlp not found in PATH. Please install yt-dlp."}
+        if j_code == 124:
+            return {"ok": False, "error": "yt-dlp timed out while fetching data."}
         # Generic failure with any captured stderr
-        err_msgs = []
-        if j_err: err_msgs.append(str(j_err)[:300])
-        if f_err and f_code is not None: err_msgs.append(str(f_err)[:300])
-        if d_err and d_code not in (None, 0): err_msgs.append(str(d_err)[:300])
-        emsg = "; ".join([e for e in err_msgs if e]) or "No size information could be determined from yt-dlp output."
-        send_message({"ok": False, "error": emsg})
-        return
-
+        emsg = str(j_err)[:300] if j_err else ""
+        return {"ok": False, "error": emsg or "No size information could be determined from yt-dlp output."}
+
+    # Duration comes from the metadata; if that failed, fall back to the hint,
+    # then to InnerTube (at most one player request per lookup). This runs only
+    # once sizes are known, so failed lookups do not wait on it.
+    if dur_sec is None and duration_hint is not None:
+        _dbg("using duration_hint for response duration")
+        dur_sec = duration_hint
+    elif dur_sec is None and player_fetched:
+        # Reuse the player response this request already fetched
+        dur_sec = player_dur
+    elif dur_sec is None:
+        _dbg("fetching duration via InnerTube ...")
+        dur_sec = _fetch_duration_innertube(vid)
+
+    human = {k: humanize_bytes(byte_sizes[k]) if byte_sizes[k] is not None else None for k in RESPONSE_COMBINED_KEYS}
+    human["duration"] = humanize_duration(dur_sec)
     resp = {
         "ok": True,
-        "bytes": {
-            "s144p": s144,
-            "s240p": s240,
-            "s360p": s360,
-            "s480p": s480,
-            "s720p": s720,
-            "s1080p": s1080,
-            "s1440p": s1440,
-            "v394": v144,
-            "v395": v240,
-            "v396": v360,
-            "v397": v480,
-            "v398": v720,
-            "v399": v1080,
-            "v400": v1440,
-            "v299": v1080_299,
-            "v303": v1080_303,
-            "v308": v1440_308,
-            "s1080p_299": s1080_299,
-            "s1080p_303": s1080_303,
-            "s1080p_399": s1080_399,
-            "s1440p_308": s1440_308,
-            "s1440p_400": s1440_400,
-            "a251": a251
-        },
-        "human": {
-            "s144p": humanize_bytes(s144) if s144 is not None else None,
-            "s240p": humanize_bytes(s240) if s240 is not None else None,
-            "s360p": humanize_bytes(s360) if s360 is not None else None,
-            "s480p": humanize_bytes(s480) if s480 is not None else None,
-            "s720p": humanize_bytes(s720) if s720 is not None else None,
-            "s1080p": humanize_bytes(s1080) if s1080 is not None else None,
-            "s1440p": humanize_bytes(s1440) if s1440 is not None else None,
-            "s1080p_299": humanize_bytes(s1080_299) if s1080_299 is not None else None,
-            "s1080p_303": humanize_bytes(s1080_303) if s1080_303 is not None else None,
-            "s1080p_399": humanize_bytes(s1080_399) if s1080_399 is not None else None,
-            "s1440p_308": humanize_bytes(s1440_308) if s1440_308 is not None else None,
-            "s1440p_400": humanize_bytes(s1440_400) if s1440_400 is not None else None,
-            "duration": dur_h
-        },
+        "bytes": byte_sizes,
+        "human": human,
         "duration": dur_sec,
     }
-    _dbg("sending response")
-    send_message(resp)
+    return resp
+
+
+def main():
+    """Serve native messaging requests until the browser closes the pipe.
+    
+    The extension currently opens a connectNative() port per lookup and
+    disconnects after the first response, so this usually handles a single
+    message; looping until EOF keeps the host correct for a port that sends
+    more than one.
+    """
+    _dbg("start")
+    while True:
+        req = read_message()
+        if req is None:
+            _dbg("no more requests; exiting")
+            return
+        resp = handle_request(req)
+        _dbg("sending response")
+        send_message(resp)
 
 
 if __name__ == '__main__':